@@ -4,6 +4,8 @@ import numpy as np
 from flask import Flask
 from config import Config
 from routes import init_routes
+from vector_index import EmbeddingIndex
+from explain import ExplanationCache, build_explain_model, find_last_conv_layer, find_layer, model_file_version
 import logging
 from flask_cors import CORS
 from pymongo import MongoClient
@@ -52,9 +54,60 @@ def create_app():
         _ = app.model.predict(dummy_input)
         logger.info("Model prediction test successful")
 
+        # Keys the embedding index and explanation cache so a retrained model never reuses their data
+        app.model_version = Config.MODEL_VERSION or model_file_version(Config.MODEL_PATH)
+        logger.info(f"Model version {app.model_version}")
+
     except Exception as e:
         logger.error(f"Error loading or testing model: {str(e)}")
         app.model = None
+        app.model_version = None
+
+    # Expose the embedding layer alongside the class probabilities so both come out of one forward pass
+    app.feature_model = None
+    app.embedding_index = None
+    embedding_layer = None
+    if app.model is not None:
+        try:
+            if Config.EMBEDDING_LAYER:
+                embedding_layer = app.model.get_layer(Config.EMBEDDING_LAYER)
+            else:
+                embedding_layer = app.model.layers[-2]
+            app.feature_model = tf.keras.Model(inputs=app.model.inputs,
+                                               outputs=[embedding_layer.output, app.model.outputs[0]])
+            embedding_dim = int(np.prod(embedding_layer.output.shape[1:]))
+
+            index_dir = Config.EMBEDDING_INDEX_DIR / app.model_version / embedding_layer.name
+            app.embedding_index = EmbeddingIndex(index_dir, embedding_dim, model_version=app.model_version,
+                                                 ivf_nlist=Config.EMBEDDING_IVF_NLIST,
+                                                 ivf_min_vectors=Config.EMBEDDING_IVF_MIN_VECTORS)
+            logger.info(f"Embedding index ready using layer '{embedding_layer.name}' (dim={embedding_dim})")
+        except Exception as e:
+            logger.error(f"Error setting up embedding index: {str(e)}")
+            app.feature_model = None
+            app.embedding_index = None
+            embedding_layer = None
+
+    # Grad-CAM model: conv feature map, the embedding (if available), class logits, then probabilities
+    app.explain_model = None
+    app.explanation_cache = None
+    app.gradcam_layer_name = None
+    if app.model is not None:
+        try:
+            if Config.GRADCAM_LAYER:
+                conv_layer = find_layer(app.model, Config.GRADCAM_LAYER)
+            else:
+                conv_layer = find_last_conv_layer(app.model)
+            extra_layers = [embedding_layer] if app.feature_model is not None else []
+            app.explain_model = build_explain_model(app.model, conv_layer, extra_layers)
+
+            app.gradcam_layer_name = conv_layer.name
+            app.explanation_cache = ExplanationCache(Config.EXPLANATION_CACHE_DIR)
+            logger.info(f"Grad-CAM ready using layer '{conv_layer.name}' (model version {app.model_version})")
+        except Exception as e:
+            logger.error(f"Error setting up Grad-CAM explanations: {str(e)}")
+            app.explain_model = None
+            app.explanation_cache = None
 
     @app.route('/model_error')
     def model_error():
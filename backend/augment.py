@@ -0,0 +1,92 @@
+import logging
+from functools import lru_cache
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_VIEW = 'identity'
+
+
+def _parse_view(view):
+    """Split a view spec like 'rot:10' into its kind and numeric parameter"""
+    kind, _, param = view.partition(':')
+    if kind in (IDENTITY_VIEW, 'hflip', 'vflip'):
+        return kind, None
+    if kind in ('rot', 'crop'):
+        try:
+            return kind, float(param)
+        except ValueError:
+            raise ValueError(f"Invalid parameter for TTA view '{view}'")
+    raise ValueError(f"Unknown TTA view '{view}'")
+
+
+@lru_cache(maxsize=32)
+def view_pixel_indices(views, size):
+    """Build flat gather indices of shape (K, size * size) for the given views.
+
+    Every view is expressed as a nearest-neighbour lookup into the flattened
+    source image, so flips, rotations and centre crops are all a single
+    `np.take` per view.
+    """
+    center = (size - 1) / 2.0
+    grid_y, grid_x = np.meshgrid(np.arange(size, dtype=np.float32) - center,
+                                 np.arange(size, dtype=np.float32) - center,
+                                 indexing='ij')
+    indices = np.empty((len(views), size * size), dtype=np.intp)
+
+    for i, view in enumerate(views):
+        kind, param = _parse_view(view)
+        src_y, src_x = grid_y, grid_x
+        if kind == 'hflip':
+            src_x = -grid_x
+        elif kind == 'vflip':
+            src_y = -grid_y
+        elif kind == 'rot':
+            theta = np.deg2rad(param)
+            cos_t, sin_t = np.cos(theta), np.sin(theta)
+            src_y = cos_t * grid_y - sin_t * grid_x
+            src_x = sin_t * grid_y + cos_t * grid_x
+        elif kind == 'crop':
+            # Centre crop of `param` of the side length, resized back to full size
+            src_y = grid_y * param
+            src_x = grid_x * param
+
+        rows = np.clip(np.rint(src_y + center), 0, size - 1).astype(np.intp)
+        cols = np.clip(np.rint(src_x + center), 0, size - 1).astype(np.intp)
+        indices[i] = (rows * size + cols).ravel()
+
+    indices.setflags(write=False)
+    return indices
+
+
+def write_tta_views(images, views, out):
+    """Write K augmented views of each image into `out` as a (N * K, H, W, C) batch.
+
+    Views of the same image are stored contiguously with the un-augmented view
+    first, so predictions can be reshaped to (N, K, num_classes) and averaged
+    over axis 1, and view 0 of each image can be used on its own.
+    """
+    n, height, width, channels = images.shape
+    if height != width:
+        raise ValueError(f"TTA expects square images, got {height}x{width}")
+
+    views = tuple(views)
+    if not views or views[0] != IDENTITY_VIEW:
+        raise ValueError(f"The first TTA view must be '{IDENTITY_VIEW}', got {views[:1]}")
+
+    if not out.flags.c_contiguous:
+        raise ValueError("TTA batch buffer must be C-contiguous")
+
+    # (N, K, H * W, C) view of the batch buffer; every write below lands in it directly
+    out_views = out.reshape((n, len(views), height * width, channels))
+    out_views[:, 0] = images.reshape((n, height * width, channels))
+    if len(views) == 1:
+        return out
+
+    indices = view_pixel_indices(views, height)
+    for i in range(n):
+        source = out_views[i, 0]
+        for k in range(1, len(views)):
+            np.take(source, indices[k], axis=0, out=out_views[i, k], mode='clip')
+    return out
@@ -11,6 +11,26 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     MODEL_PATH = BASE_DIR / 'model' / 'model.h5'
+    IMAGE_SIZE = 224
+
+    # Test-time augmentation views, scored in the same batch as the original image.
+    # 'identity' must stay first (write_tta_views rejects anything else); see augment.py for the view specs.
+    TTA_VIEWS = ('identity', 'hflip', 'rot:10', 'rot:-10', 'crop:0.9')
+
+    # Similar-case retrieval over penultimate-layer embeddings
+    EMBEDDING_INDEX_DIR = BASE_DIR / 'embeddings'
+    EMBEDDING_LAYER = os.environ.get('EMBEDDING_LAYER')  # Defaults to the model's penultimate layer
+    SIMILAR_TOP_K = 5
+    # IVF partitioning is built in the background once the index grows past EMBEDDING_IVF_MIN_VECTORS
+    EMBEDDING_IVF_NLIST = 1024
+    EMBEDDING_IVF_NPROBE = 8
+    EMBEDDING_IVF_MIN_VECTORS = 100000
+
+    # Grad-CAM explanations, cached by image hash and model version
+    EXPLANATION_CACHE_DIR = BASE_DIR / 'explanations'
+    GRADCAM_LAYER = os.environ.get('GRADCAM_LAYER')  # Defaults to the last layer with a spatial output
+    EXPLANATION_OVERLAY_SIZE = 224
+    MODEL_VERSION = os.environ.get('MODEL_VERSION')  # Defaults to a hash of the model file
     DEBUG = False
 
     @classmethod
@@ -18,6 +38,8 @@ class Config:
         try:
             cls.UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
             cls.MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
+            cls.EMBEDDING_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            cls.EXPLANATION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
             if not os.getenv('SECRET_KEY'):
                 print("Warning: SECRET_KEY is not set. Using default key.")
@@ -0,0 +1,228 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def find_last_conv_layer(model):
+    """Last layer producing a spatial (batch, H, W, C) feature map.
+
+    When that layer is a nested base model (e.g. a pretrained backbone wrapped in a
+    Sequential), the search continues inside it.
+    """
+    for layer in reversed(model.layers):
+        try:
+            if len(layer.output.shape) != 4:
+                continue
+        except (AttributeError, ValueError):
+            continue
+        if isinstance(layer, tf.keras.Model):
+            return find_last_conv_layer(layer)
+        return layer
+    raise ValueError("Model has no layer with a 4D output to explain")
+
+
+def find_layer(model, name):
+    """Layer called `name` in `model` or in one of its nested base models"""
+    for layer in model.layers:
+        if layer.name == name:
+            return layer
+        if isinstance(layer, tf.keras.Model):
+            try:
+                return find_layer(layer, name)
+            except ValueError:
+                continue
+    raise ValueError(f"No layer named '{name}' in model '{model.name}'")
+
+
+def _class_logits(final_layer, final_input, final_output):
+    """Symbolic pre-softmax class scores, leaving the model itself untouched"""
+    activation = final_layer.get_config().get('activation')
+    if isinstance(final_layer, tf.keras.layers.Activation) and activation == 'softmax':
+        return final_input
+    if isinstance(final_layer, tf.keras.layers.Dense) and activation == 'softmax':
+        # Re-apply the final Dense layer's weights without its softmax
+        linear = tf.keras.layers.Dense(final_layer.units, activation=None, name=f"{final_layer.name}_logits")
+        logits = linear(final_input)
+        linear.set_weights(final_layer.get_weights())
+        return logits
+    logger.warning(f"Final layer '{final_layer.name}' is not a softmax; using its output as class scores")
+    return final_output
+
+
+def _nested_base(model, conv_layer):
+    """Top-level sub-model of `model` that contains `conv_layer`, or None if it is a top-level layer"""
+    if conv_layer in model.layers:
+        return None
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model) and conv_layer in layer.layers:
+            return layer
+    raise ValueError(f"Layer '{conv_layer.name}' is not part of model '{model.name}'")
+
+
+def build_explain_model(model, conv_layer, extra_layers=()):
+    """Model returning [conv feature map, *outputs of extra_layers, class logits, class probabilities].
+
+    `extra_layers` must be top-level layers of `model`. If `conv_layer` sits inside a
+    nested base model, the top-level layers are chained as a plain stack, with the
+    base replaced by a sub-model that also exposes the conv feature map.
+    """
+    base = _nested_base(model, conv_layer)
+    if base is None:
+        final_layer = model.layers[-1]
+        outputs = ([conv_layer.output] + [layer.output for layer in extra_layers]
+                   + [_class_logits(final_layer, final_layer.input, model.outputs[0]), model.outputs[0]])
+        return tf.keras.Model(inputs=model.inputs, outputs=outputs)
+
+    base_with_conv = tf.keras.Model(inputs=base.inputs, outputs=[conv_layer.output, base.outputs[0]])
+    inputs = tf.keras.Input(shape=model.inputs[0].shape[1:], dtype=model.inputs[0].dtype)
+    layers = [layer for layer in model.layers if not isinstance(layer, tf.keras.layers.InputLayer)]
+    x, layer_outputs = inputs, {}
+    for layer in layers:
+        layer_input = x
+        if layer is base:
+            conv_map, x = base_with_conv(x)
+        else:
+            x = layer(x)
+        layer_outputs[layer.name] = x
+
+    missing = [layer.name for layer in extra_layers if layer.name not in layer_outputs]
+    if missing:
+        raise ValueError(f"Extra output layers {missing} are not top-level layers of model '{model.name}'")
+    outputs = ([conv_map] + [layer_outputs[layer.name] for layer in extra_layers]
+               + [_class_logits(layers[-1], layer_input, x), x])
+    return tf.keras.Model(inputs=inputs, outputs=outputs)
+
+
+def image_hash(image_array):
+    """Stable hash of a preprocessed image, independent of upload filename or format"""
+    return hashlib.sha256(np.ascontiguousarray(image_array).tobytes()).hexdigest()
+
+
+def explanation_key(image_hash_hex, layer_name, views):
+    """Cache key for a heatmap: the image plus the layer and TTA views that decide how it is explained"""
+    variant = hashlib.sha256('|'.join((layer_name,) + tuple(views)).encode('utf-8')).hexdigest()[:12]
+    return f"{image_hash_hex}_{variant}"
+
+
+def model_file_version(model_path):
+    """Short content hash of the model file, used as the model version for caching"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def predict_with_gradcam(explain_model, batch, num_views=1):
+    """Run one forward and one gradient pass over the whole batch.
+
+    `explain_model` comes from `build_explain_model`. Views of the same image are
+    expected to be contiguous with the un-augmented view first; heatmaps are
+    computed for that view, targeting the class with the highest view-averaged
+    probability. Gradients are taken on the pre-softmax logit, which does not
+    saturate for confident predictions.
+
+    Returns (model outputs as NumPy arrays, heatmaps of shape (N, h, w) in [0, 1],
+    target class index per image).
+    """
+    batch = tf.convert_to_tensor(batch)
+    with tf.GradientTape() as tape:
+        outputs = explain_model(batch, training=False)
+        conv_maps, logits, predictions = outputs[0], outputs[-2], outputs[-1]
+        num_classes = predictions.shape[-1]
+        probabilities = tf.reduce_mean(tf.reshape(predictions, (-1, num_views, num_classes)), axis=1)
+        targets = tf.argmax(probabilities, axis=1)
+        # Each image's score depends only on its own activations, so one gradient of
+        # the summed scores yields every per-image gradient at once
+        class_scores = tf.gather(logits[::num_views], targets, batch_dims=1)
+
+    grads = tape.gradient(class_scores, conv_maps)[::num_views]
+    conv_maps = conv_maps[::num_views]
+    weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+    heatmaps = tf.nn.relu(tf.reduce_sum(weights * conv_maps, axis=-1))
+    heatmaps = heatmaps / tf.maximum(tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True), 1e-8)
+
+    return [output.numpy() for output in outputs], heatmaps.numpy(), targets.numpy()
+
+
+def _jet(values):
+    """Map values in [0, 1] to RGB with a jet-style colormap"""
+    r = np.clip(1.5 - np.abs(4 * values - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * values - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * values - 1), 0, 1)
+    return np.stack([r, g, b], axis=-1)
+
+
+def render_overlay(heatmap, image_array, size, alpha=0.4):
+    """Blend a heatmap over the image and return it as PNG bytes"""
+    image = Image.fromarray(np.asarray(image_array, dtype=np.uint8)).resize((size, size))
+    heatmap = Image.fromarray(np.asarray(heatmap, dtype=np.float32)).resize((size, size), Image.BILINEAR)
+    colored = _jet(np.clip(np.asarray(heatmap), 0, 1)) * 255
+    blended = (1 - alpha) * np.asarray(image, dtype=np.float32) + alpha * colored
+
+    buffer = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class ExplanationCache:
+    """On-disk Grad-CAM cache keyed by model version and explanation key"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, model_version, key, suffix):
+        return self.directory / f"{model_version}_{key}{suffix}"
+
+    def get(self, model_version, key):
+        """Cached (heatmap, overlay PNG bytes, target class index), or None if never explained"""
+        heatmap_path = self._path(model_version, key, '.npz')
+        overlay_path = self._path(model_version, key, '.png')
+        if not heatmap_path.exists() or not overlay_path.exists():
+            return None
+        try:
+            with np.load(heatmap_path) as cached:
+                heatmap, target_class = cached['heatmap'].astype(np.float32), int(cached['target_class'])
+            return heatmap, overlay_path.read_bytes(), target_class
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cached explanation {key}: {str(e)}")
+            return None
+
+    def _write_atomic(self, path, write):
+        """Write through a temp file in the cache directory and rename it into place"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{path.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, model_version, key, heatmap, overlay_png, target_class):
+        # Each file appears complete or not at all; the overlay is replaced last because
+        # get() treats its presence as marking a finished entry
+        self._write_atomic(self._path(model_version, key, '.npz'),
+                           lambda f: np.savez(f, heatmap=heatmap.astype(np.float16),
+                                              target_class=np.int64(target_class)))
+        self._write_atomic(self._path(model_version, key, '.png'), lambda f: f.write(overlay_png))
+
+
+def format_explanation(heatmap, overlay_png, target_class, output_format, class_names):
+    """Explanation payload for a JSON response in the requested format ('png' or 'array')"""
+    target = class_names[target_class] if 0 <= target_class < len(class_names) else 'Unknown'
+    if output_format == 'array':
+        heatmap = np.round(np.asarray(heatmap, dtype=np.float64), 3)
+        return {'format': 'array', 'target_class': target, 'heatmap': heatmap.tolist()}
+    return {'format': 'png', 'target_class': target, 'overlay': base64.b64encode(overlay_png).decode('ascii')}
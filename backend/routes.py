@@ -8,8 +8,11 @@ import re
 from pathlib import Path
 import logging
 import datetime
+import time
 import tensorflow as tf
 from config import Config
+from augment import IDENTITY_VIEW, write_tta_views
+from explain import explanation_key, format_explanation, image_hash, predict_with_gradcam, render_overlay
 from typing import Dict, List, Optional, Union, Any
 
 # Configure logging
@@ -25,6 +28,7 @@ DISEASE_CLASSES = [
 def init_routes(app: Any, db: Any) -> Any:
     users_collection = db['users']
     patient_history_collection = db['patient_history']
+    app.patient_history_collection = patient_history_collection
 
     def allowed_file(filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
@@ -36,8 +40,8 @@ def init_routes(app: Any, db: Any) -> Any:
     def preprocess_image(filepath):
         try:
             route_logger.info(f"Preprocessing image at {filepath}")
-            image = Image.open(filepath)
-            image = image.resize((224, 224))  # Adjusted image resizing
+            image = Image.open(filepath).convert('RGB')
+            image = image.resize((Config.IMAGE_SIZE, Config.IMAGE_SIZE))  # Adjusted image resizing
             image_array = np.array(image)
             image_array = np.expand_dims(image_array, axis=0)
             return image_array
@@ -45,17 +49,104 @@ def init_routes(app: Any, db: Any) -> Any:
             route_logger.error(f"Error in preprocess_image: {str(e)}")
             return None
 
-    def get_prediction(preprocessed_image):
+    def preprocess_upload(file):
+        """Save an uploaded file, preprocess it and remove it again"""
+        filename = secure_filename(file.filename)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         try:
-            route_logger.info("Running model prediction...")
-            predictions = app.model.predict(preprocessed_image)
-            route_logger.info(f"Raw predictions: {predictions}")
-            predicted_label = np.argmax(predictions, axis=1)[0]
-            route_logger.info(f"Prediction result: {predicted_label}")
-            return int(predicted_label)
+            app.logger.info(f"Attempting to save file at: {filepath}")
+            file.save(filepath)
+            app.logger.info(f"File saved successfully at: {filepath}")
+            return filename, preprocess_image(filepath)
+        finally:
+            try:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                    app.logger.info(f"Cleaned up file: {filepath}")
+                else:
+                    app.logger.warning(f"File not found for cleanup: {filepath}")
+            except Exception as e:
+                app.logger.error(f"Error removing temporary file: {str(e)}")
+
+    def score_images(images, views=(IDENTITY_VIEW,), with_embeddings=False, with_heatmaps=False):
+        """Score a batch of images in one forward pass, averaging over the TTA views.
+
+        Returns (probabilities, embeddings, heatmaps, targets). Embeddings and Grad-CAM
+        heatmaps come from the un-augmented view of each image and, like the heatmaps'
+        target classes, are None unless requested; heatmaps add a single gradient pass
+        over the whole batch.
+        """
+        try:
+            num_images, num_views = len(images), len(views)
+            route_logger.info(f"Running model prediction on {num_images} image(s) x {num_views} view(s)...")
+            batch = np.empty((num_images * num_views,) + images.shape[1:], dtype=np.float32)
+            write_tta_views(images, views, batch)
+
+            features = heatmaps = targets = None
+            if with_heatmaps:
+                outputs, heatmaps, targets = predict_with_gradcam(app.explain_model, batch, num_views)
+                predictions = outputs[-1]
+                if with_embeddings:
+                    features = outputs[1]
+            elif with_embeddings:
+                features, predictions = app.feature_model.predict(batch, verbose=0)
+            else:
+                predictions = app.model.predict(batch, verbose=0)
+
+            embeddings = None
+            if features is not None:
+                embeddings = features.reshape(num_images, num_views, -1)[:, 0]
+
+            probabilities = predictions.reshape(num_images, num_views, -1).mean(axis=1)
+            route_logger.info(f"Prediction result: {np.argmax(probabilities, axis=1)}")
+            return probabilities, embeddings, heatmaps, targets
         except Exception as e:
-            route_logger.error(f"Error in get_prediction: {str(e)}")
-            return None
+            route_logger.error(f"Error in score_images: {str(e)}")
+            return None, None, None, None
+
+    def collect_uploads(files):
+        """Preprocess every allowed upload.
+
+        Returns (results, pending, error): one result dict per file in request order,
+        (index into results, image) for each file ready to be scored, and an error
+        response if preprocessing failed outright.
+        """
+        results = []
+        pending = []
+        for file in files:
+            if file and allowed_file(file.filename):
+                try:
+                    filename, preprocessed_image = preprocess_upload(file)
+                    if preprocessed_image is None:
+                        return results, pending, (jsonify({'error': 'Error preprocessing image'}), 500)
+
+                    results.append({'filename': filename})
+                    pending.append((len(results) - 1, preprocessed_image))
+
+                except Exception as e:
+                    app.logger.error(f"Error during prediction process for {file.filename}: {str(e)}")
+                    results.append({'filename': file.filename, 'error': f'Prediction process error: {str(e)}'})
+
+            else:
+                app.logger.error(f"File type not allowed: {file.filename}")
+                results.append({'filename': file.filename, 'error': 'File type not allowed'})
+
+        return results, pending, None
+
+    def search_similar(embeddings, query_hashes, k):
+        """Top-k prior scans per query, skipping stored copies of the query scan itself"""
+        fetch = k + 1
+        while True:
+            matches = app.embedding_index.search(embeddings, k=fetch, nprobe=Config.EMBEDDING_IVF_NPROBE)
+            filtered = [[match for match in image_matches if match.get('image_hash') != query_hash][:k]
+                        for image_matches, query_hash in zip(matches, query_hashes)]
+            # Done once every query has k results or the index ran out of candidates
+            if all(len(kept) >= k or len(found) < fetch for kept, found in zip(filtered, matches)):
+                return filtered
+            fetch *= 2
+
+    def disease_name(prediction_index):
+        return DISEASE_CLASSES[prediction_index] if 0 <= prediction_index < len(DISEASE_CLASSES) else 'Unknown'
 
     @app.route('/test_upload', methods=['POST'])
     def test_upload():
@@ -110,76 +201,188 @@ def init_routes(app: Any, db: Any) -> Any:
                 app.logger.error("No selected files")
                 return jsonify({'error': 'No selected files'}), 400
 
-            predictions = []
-
-            for file in files:
-                if file and allowed_file(file.filename):
+            tta = request.form.get('tta', '').lower() in ('1', 'true', 'yes')
+            views = Config.TTA_VIEWS if tta else (IDENTITY_VIEW,)
+
+            index_embedding = request.form.get('index_embedding', '').lower() in ('1', 'true', 'yes')
+            if index_embedding and getattr(app, 'embedding_index', None) is None:
+                app.logger.warning("Embedding index is not available, skipping indexing")
+                index_embedding = False
+
+            explain = request.form.get('explain', '').lower()
+            if explain in ('1', 'true', 'yes'):
+                explain = 'png'
+            if explain not in ('', 'png', 'array'):
+                return jsonify({'error': "explain must be 'png' or 'array'"}), 400
+            if explain and getattr(app, 'explain_model', None) is None:
+                app.logger.warning("Grad-CAM is not available, skipping explanations")
+                explain = ''
+
+            predictions, pending, error_response = collect_uploads(files)
+            if error_response is not None:
+                return error_response
+
+            timings = {}
+            if pending:
+                images = np.concatenate([image for _, image in pending], axis=0)
+                image_hashes = [image_hash(image) for image in images]
+
+                # The heatmap's target class depends on the TTA views, so they are part of the cache key
+                explanation_keys = [explanation_key(key, app.gradcam_layer_name, views) for key in image_hashes] \
+                    if explain else []
+                cached_explanations = {}
+                for key in explanation_keys:
+                    cached = app.explanation_cache.get(app.model_version, key)
+                    if cached is not None:
+                        cached_explanations[key] = cached
+                need_heatmaps = bool(explain) and len(cached_explanations) < len(set(explanation_keys))
+
+                # Score every uploaded image (and all of its TTA views) in a single forward pass
+                started = time.perf_counter()
+                probabilities, embeddings, heatmaps, targets = score_images(
+                    images, views, with_embeddings=index_embedding, with_heatmaps=need_heatmaps)
+                timings['inference' if not need_heatmaps else 'inference_gradcam'] = time.perf_counter() - started
+                if probabilities is None:
+                    return jsonify({'error': 'Error making prediction'}), 500
+
+                # Embeddings and index records for the scans that were scored successfully
+                index_rows, index_records, index_slots = [], [], []
+
+                for row, ((slot, _), image_probabilities) in enumerate(zip(pending, probabilities)):
+                    prediction_result = predictions[slot]
                     try:
-                        filename = secure_filename(file.filename)
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        app.logger.info(f"Attempting to save file at: {filepath}")
-                        file.save(filepath)
-                        app.logger.info(f"File saved successfully at: {filepath}")
-
-                        preprocessed_image = preprocess_image(filepath)
-                        if preprocessed_image is None:
-                            return jsonify({'error': 'Error preprocessing image'}), 500
-
-                        prediction_index = get_prediction(preprocessed_image)
-                        if prediction_index is None:
-                            return jsonify({'error': 'Error making prediction'}), 500
-
-                        try:
-                            prediction_index = int(prediction_index)
-                        except ValueError:
-                            app.logger.error(f"Invalid prediction index for {filename}: {prediction_index}")
-                            return jsonify({'error': 'Invalid prediction index'}), 500
-
-                        # Commenting out the probabilities part
-                        # probabilities = app.model.predict(preprocessed_image)[0]
-
-                        # Create response for the current file
-                        prediction_result = {
-                            'filename': filename,
-                            'disease': DISEASE_CLASSES[prediction_index] if 0 <= prediction_index < len(
-                                DISEASE_CLASSES) else 'Unknown',
-                            # 'probabilities': {class_name: float(prob) for class_name, prob in zip(DISEASE_CLASSES, probabilities)}  # Commented out
+                        prediction_result['disease'] = disease_name(int(np.argmax(image_probabilities)))
+                        prediction_result['probabilities'] = {
+                            class_name: float(prob) for class_name, prob in zip(DISEASE_CLASSES, image_probabilities)
                         }
-
+                        prediction_result['tta_views'] = len(views)
+                        prediction_result['image_hash'] = image_hashes[row]
+                        prediction_result['model_version'] = getattr(app, 'model_version', None)
+                        if explain:
+                            prediction_result['explanation_key'] = explanation_keys[row]
+
+                        history_id = None
+                        timestamp = datetime.datetime.utcnow()
                         if patient_id and hasattr(app, 'patient_history_collection'):
-                            app.patient_history_collection.insert_one({
+                            history_id = str(app.patient_history_collection.insert_one({
                                 'patient_id': patient_id,
-                                'filename': filename,
-                                'prediction': prediction_result,
-                                'timestamp': datetime.utcnow()
+                                'filename': prediction_result['filename'],
+                                'prediction': dict(prediction_result),
+                                'timestamp': timestamp
+                            }).inserted_id)
+                            prediction_result['history_id'] = history_id
+
+                        if index_embedding:
+                            index_rows.append(row)
+                            index_slots.append(slot)
+                            index_records.append({
+                                'history_id': history_id,
+                                'patient_id': patient_id,
+                                'filename': prediction_result['filename'],
+                                'image_hash': image_hashes[row],
+                                'disease': prediction_result['disease'],
+                                'timestamp': timestamp.isoformat()
                             })
 
-                        predictions.append(prediction_result)
-
+                        if explain:
+                            started = time.perf_counter()
+                            key = explanation_keys[row]
+                            if key not in cached_explanations:
+                                overlay_png = render_overlay(heatmaps[row], images[row], Config.EXPLANATION_OVERLAY_SIZE)
+                                target_class = int(targets[row])
+                                app.explanation_cache.put(app.model_version, key, heatmaps[row], overlay_png, target_class)
+                                cached_explanations[key] = (heatmaps[row], overlay_png, target_class)
+                            prediction_result['explanation'] = format_explanation(*cached_explanations[key], explain,
+                                                                                  DISEASE_CLASSES)
+                            timings['explain_render'] = timings.get('explain_render', 0.0) + time.perf_counter() - started
                     except Exception as e:
-                        app.logger.error(f"Error during prediction process for {file.filename}: {str(e)}")
-                        predictions.append({'filename': file.filename, 'error': f'Prediction process error: {str(e)}'})
-
-                    finally:
-                        try:
-                            if os.path.exists(filepath):
-                                os.remove(filepath)
-                                app.logger.info(f"Cleaned up file: {filepath}")
-                            else:
-                                app.logger.warning(f"File not found for cleanup: {filepath}")
-                        except Exception as e:
-                            app.logger.error(f"Error removing temporary file: {str(e)}")
+                        app.logger.error(f"Error during prediction process for {prediction_result['filename']}: {str(e)}")
+                        prediction_result['error'] = f'Prediction process error: {str(e)}'
 
-                else:
-                    app.logger.error(f"File type not allowed: {file.filename}")
-                    predictions.append({'filename': file.filename, 'error': 'File type not allowed'})
+                if index_rows:
+                    try:
+                        embedding_ids = app.embedding_index.add(embeddings[index_rows], index_records)
+                        for slot, embedding_id in zip(index_slots, embedding_ids):
+                            predictions[slot]['embedding_id'] = embedding_id
+                    except Exception as e:
+                        app.logger.error(f"Error adding embeddings to index: {str(e)}")
 
-            return jsonify(predictions), 200
+            # Report where the time went so explanation overhead can be compared with plain prediction
+            app.logger.info("Predict timings: " + ", ".join(f"{name}={seconds * 1000:.1f}ms"
+                                                            for name, seconds in timings.items()))
+            response = jsonify(predictions)
+            response.headers['Server-Timing'] = ", ".join(f"{name};dur={seconds * 1000:.1f}"
+                                                          for name, seconds in timings.items())
+            return response, 200
 
         except Exception as e:
             app.logger.error(f"Unexpected error in predict route: {str(e)}")
             return jsonify({'error': 'An unexpected error occurred'}), 500
 
+    @app.route('/similar', methods=['POST'])
+    def similar():
+        try:
+            if getattr(app, 'embedding_index', None) is None:
+                return jsonify({'error': 'Similar-case search is not available'}), 503
+
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+
+            files = request.files.getlist('file')
+            if not files or all(file.filename == '' for file in files):
+                return jsonify({'error': 'No selected files'}), 400
+
+            try:
+                k = int(request.form.get('k', Config.SIMILAR_TOP_K))
+            except ValueError:
+                return jsonify({'error': 'k must be an integer'}), 400
+            if k < 1:
+                return jsonify({'error': 'k must be at least 1'}), 400
+
+            results, pending, error_response = collect_uploads(files)
+            if error_response is not None:
+                return error_response
+
+            if pending:
+                images = np.concatenate([image for _, image in pending], axis=0)
+                probabilities, embeddings, _, _ = score_images(images, with_embeddings=True)
+                if probabilities is None:
+                    return jsonify({'error': 'Error making prediction'}), 500
+
+                matches = search_similar(embeddings, [image_hash(image) for image in images], k)
+                for (slot, _), image_probabilities, image_matches in zip(pending, probabilities, matches):
+                    results[slot]['disease'] = disease_name(int(np.argmax(image_probabilities)))
+                    results[slot]['similar'] = image_matches
+
+            return jsonify(results), 200
+
+        except Exception as e:
+            app.logger.error(f"Unexpected error in similar route: {str(e)}")
+            return jsonify({'error': 'An unexpected error occurred'}), 500
+
+    @app.route('/explanation/<key>', methods=['GET'])
+    def get_explanation(key: str):
+        try:
+            if getattr(app, 'explanation_cache', None) is None:
+                return jsonify({'error': 'Explanations are not available'}), 503
+
+            model_version = request.args.get('model_version', app.model_version)
+            output_format = request.args.get('format', 'png')
+            if not re.fullmatch(r'[0-9a-f]{64}_[0-9a-f]{12}', key) or not re.fullmatch(r'[\w.-]+', model_version):
+                return jsonify({'error': 'Invalid explanation key or model version'}), 400
+            if output_format not in ('png', 'array'):
+                return jsonify({'error': "format must be 'png' or 'array'"}), 400
+
+            cached = app.explanation_cache.get(model_version, key)
+            if cached is None:
+                return jsonify({'error': 'No explanation cached for this image'}), 404
+
+            return jsonify(dict(format_explanation(*cached, output_format, DISEASE_CLASSES),
+                                explanation_key=key, model_version=model_version)), 200
+        except Exception as e:
+            route_logger.error(f"Error fetching explanation: {str(e)}")
+            return jsonify({'error': 'Error fetching explanation'}), 500
+
     @app.route('/signup', methods=['POST'])
     def signup():
         data = request.json
@@ -0,0 +1,316 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _write_at(path, position, data):
+    """Write bytes at an absolute position, overwriting any uncommitted tail left by a crash"""
+    with open(path, 'r+b' if path.exists() else 'wb') as f:
+        f.seek(position)
+        f.write(data)
+
+
+def _merge_top_k(best_scores, best_ids, scores, ids, k):
+    """Merge a block of candidate scores into the running per-query top-k"""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    ids = np.concatenate([best_ids, np.broadcast_to(ids, scores[:, best_ids.shape[1]:].shape)], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        ids = np.take_along_axis(ids, keep, axis=1)
+    return scores, ids
+
+
+class EmbeddingIndex:
+    """Append-only cosine-similarity index over scan embeddings.
+
+    Vectors are L2-normalised and stored as a raw float16 matrix that is
+    memory-mapped for search. Per-vector metadata goes to a JSON-lines sidecar
+    with a fixed-width (offset, length) table, so records are only read for
+    the ids a search returns. The offsets table is written last and marks a
+    row as committed. A manifest pins the dim and model version the index was
+    built with; opening it with different ones is an error.
+
+    Search is a batched brute-force scan unless an IVF partitioning has been
+    built with `build_ivf`, in which case only the `nprobe` closest lists are
+    scanned (more if they hold fewer than k vectors). Given `ivf_nlist`, the
+    partitioning is built in a background thread once the index reaches
+    `ivf_min_vectors`, whether at startup or after an append.
+    """
+
+    VECTORS_FILE = 'vectors.f16'
+    METADATA_FILE = 'metadata.jsonl'
+    OFFSETS_FILE = 'metadata.offsets'
+    MANIFEST_FILE = 'index.json'
+    CENTROIDS_FILE = 'ivf_centroids.npy'
+    ASSIGNMENTS_FILE = 'ivf_assignments.i32'
+    SEARCH_CHUNK = 65536
+
+    def __init__(self, directory, dim, model_version=None, ivf_nlist=0, ivf_min_vectors=0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = int(dim)
+        self.model_version = model_version
+        self.ivf_nlist = ivf_nlist
+        self.ivf_min_vectors = ivf_min_vectors
+        self._lock = threading.Lock()
+        self._ivf_thread = None
+        self._vectors_path = self.directory / self.VECTORS_FILE
+        self._metadata_path = self.directory / self.METADATA_FILE
+        self._offsets_path = self.directory / self.OFFSETS_FILE
+        self._centroids_path = self.directory / self.CENTROIDS_FILE
+        self._assignments_path = self.directory / self.ASSIGNMENTS_FILE
+        self._check_manifest()
+
+        row_bytes = self.dim * np.dtype(np.float16).itemsize
+        stored_rows = self._vectors_path.stat().st_size // row_bytes if self._vectors_path.exists() else 0
+        committed_rows = self._offsets_path.stat().st_size // 16 if self._offsets_path.exists() else 0
+        self._count = min(stored_rows, committed_rows)
+        if stored_rows != committed_rows:
+            # A write was interrupted; the uncommitted tail is ignored and overwritten by the next append
+            logger.warning(f"Embedding index has {stored_rows} vectors but {committed_rows} committed records, "
+                           f"using the first {self._count}")
+
+        self._vectors = None
+        self._offsets = None
+        self._centroids = None
+        self._list_ids = None
+        self._list_sizes = None
+        if self._centroids_path.exists():
+            self._load_ivf()
+
+        logger.info(f"Embedding index at {self.directory} holds {self._count} vectors (dim={self.dim})")
+        self._maybe_build_ivf()
+
+    def _check_manifest(self):
+        manifest_path = self.directory / self.MANIFEST_FILE
+        expected = {'dim': self.dim, 'model_version': self.model_version}
+        if manifest_path.exists():
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest != expected:
+                raise ValueError(f"Embedding index at {self.directory} was built with {manifest}, "
+                                 f"not {expected}; use a separate index directory")
+        elif self._vectors_path.exists() or self._offsets_path.exists():
+            raise ValueError(f"Embedding index at {self.directory} has no manifest; refusing to reuse it")
+        else:
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(expected, f)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def has_ivf(self):
+        return self._centroids is not None
+
+    def _get_vectors(self):
+        if self._vectors is None or self._vectors.shape[0] != self._count:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float16, mode='r', shape=(self._count, self.dim))
+        return self._vectors
+
+    def _get_offsets(self):
+        if self._offsets is None or self._offsets.shape[0] != self._count:
+            self._offsets = np.memmap(self._offsets_path, dtype=np.int64, mode='r', shape=(self._count, 2))
+        return self._offsets
+
+    def _read_metadata(self, ids):
+        """Load the metadata records for the given ids from the JSON-lines sidecar"""
+        offsets = self._get_offsets()
+        records = []
+        with open(self._metadata_path, 'rb') as f:
+            for i in ids:
+                offset, length = offsets[i]
+                f.seek(int(offset))
+                records.append(json.loads(f.read(int(length))))
+        return records
+
+    def _assign(self, vectors, centroids=None):
+        """Nearest-centroid list for each (normalised) vector, in chunks"""
+        centroids = self._centroids if centroids is None else centroids
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.SEARCH_CHUNK):
+            block = np.asarray(vectors[start:start + self.SEARCH_CHUNK], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def _load_ivf(self):
+        self._centroids = np.load(self._centroids_path).astype(np.float32)
+        assigned = np.fromfile(self._assignments_path, dtype=np.int32) if self._assignments_path.exists() else \
+            np.empty(0, dtype=np.int32)
+        assigned = assigned[:self._count]
+        if len(assigned) < self._count:
+            missing = self._assign(self._get_vectors()[len(assigned):])
+            assigned = np.concatenate([assigned, missing])
+            assigned.tofile(self._assignments_path)
+        self._set_ivf(self._centroids, assigned)
+
+    def _set_ivf(self, centroids, assignments):
+        """Group vector ids by IVF list, in ascending order for memmap locality"""
+        order = np.argsort(assignments, kind='stable')
+        sizes = np.bincount(assignments, minlength=len(centroids))
+        # One growable id buffer per list; only the first _list_sizes[p] entries are valid
+        self._list_ids = np.split(order, np.cumsum(sizes)[:-1])
+        self._list_sizes = sizes.astype(np.int64)
+        self._centroids = centroids
+
+    def _extend_lists(self, first_id, assignments):
+        """Append new ids to their lists in place; they are larger than every stored id, so order is kept"""
+        for p in np.unique(assignments):
+            new_ids = first_id + np.flatnonzero(assignments == p)
+            size, buffer = self._list_sizes[p], self._list_ids[p]
+            if size + len(new_ids) > len(buffer):
+                grown = np.empty(max(2 * len(buffer), size + len(new_ids), 16), dtype=np.intp)
+                grown[:size] = buffer[:size]
+                self._list_ids[p] = buffer = grown
+            buffer[size:size + len(new_ids)] = new_ids
+            self._list_sizes[p] += len(new_ids)
+
+    def _list(self, p):
+        return self._list_ids[p][:self._list_sizes[p]]
+
+    def _maybe_build_ivf(self):
+        """Start a background IVF build once the index is large enough and has none yet"""
+        if not self.ivf_nlist or self.has_ivf or self._ivf_thread is not None:
+            return
+        if self._count < max(self.ivf_min_vectors, self.ivf_nlist):
+            return
+
+        def build():
+            try:
+                self.build_ivf(self.ivf_nlist)
+            except Exception as e:
+                # Left in place so a failing build is not retried on every append
+                logger.error(f"Error building IVF partitioning: {str(e)}")
+
+        logger.info(f"Embedding index reached {self._count} vectors, building IVF partitioning in the background")
+        self._ivf_thread = threading.Thread(target=build, daemon=True)
+        self._ivf_thread.start()
+
+    def wait_for_ivf(self, timeout=None):
+        """Block until a background IVF build started by this index has finished"""
+        if self._ivf_thread is not None:
+            self._ivf_thread.join(timeout)
+
+    def add(self, embeddings, metadata):
+        """Append a batch of embeddings with one metadata dict per vector; returns their ids"""
+        vectors = _normalize(embeddings)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dim {self.dim}, got {vectors.shape[1]}")
+        if len(metadata) != len(vectors):
+            raise ValueError("Need exactly one metadata record per embedding")
+
+        encoded = [(json.dumps(record, default=str) + '\n').encode('utf-8') for record in metadata]
+        lengths = np.array([len(line) for line in encoded], dtype=np.int64)
+
+        with self._lock:
+            first_id = self._count
+            metadata_end = int(self._get_offsets()[-1].sum()) if first_id else 0
+            offsets = np.stack([metadata_end + np.cumsum(lengths) - lengths, lengths], axis=1)
+
+            _write_at(self._vectors_path, first_id * self.dim * 2, vectors.astype(np.float16).tobytes())
+            _write_at(self._metadata_path, metadata_end, b''.join(encoded))
+            if self.has_ivf:
+                assignments = self._assign(vectors)
+                _write_at(self._assignments_path, first_id * 4, assignments.tobytes())
+            # Committing the offsets last makes the new rows visible
+            _write_at(self._offsets_path, first_id * 16, offsets.tobytes())
+            self._count += len(vectors)
+
+            if self.has_ivf:
+                self._extend_lists(first_id, assignments)
+
+        self._maybe_build_ivf()
+        return list(range(first_id, first_id + len(vectors)))
+
+    def build_ivf(self, nlist, iterations=10, sample_size=None, seed=0):
+        """Partition the stored vectors into `nlist` lists with spherical k-means.
+
+        Training runs on a snapshot without holding the lock, so searches and
+        appends keep working; vectors appended meanwhile are assigned at the end.
+        """
+        with self._lock:
+            count = self._count
+            vectors = self._get_vectors()
+        if count < nlist:
+            raise ValueError(f"Need at least {nlist} vectors to build {nlist} IVF lists, have {count}")
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, sample_size or 64 * nlist)
+        sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Reseed empty lists from random sample points so every list stays in use
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+        assignments = self._assign(vectors, centroids)
+
+        with self._lock:
+            if self._count > count:
+                tail = self._assign(self._get_vectors()[count:], centroids)
+                assignments = np.concatenate([assignments, tail])
+            np.save(self._centroids_path, centroids)
+            assignments.tofile(self._assignments_path)
+            self._set_ivf(centroids, assignments)
+            total = self._count
+
+        logger.info(f"Built IVF partitioning with {nlist} lists over {total} vectors")
+
+    def search(self, queries, k=5, nprobe=8):
+        """Top-k cosine matches for each query as lists of metadata dicts with a 'score'"""
+        queries = _normalize(queries)
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return [[] for _ in queries]
+            vectors = self._get_vectors()
+            k = min(k, count)
+            best_scores = np.empty((len(queries), 0), dtype=np.float32)
+            best_ids = np.empty((len(queries), 0), dtype=np.int64)
+
+            if self.has_ivf:
+                centroid_order = np.argsort(-(queries @ self._centroids.T), axis=1)
+                # Scan each query's probed lists; batching across queries would scan their union instead
+                scores_per_query, ids_per_query = [], []
+                for query, order in zip(queries, centroid_order):
+                    # Probe at least nprobe lists, and keep widening until they hold k candidates
+                    covered = np.cumsum(self._list_sizes[order])
+                    num_probes = max(nprobe, int(np.searchsorted(covered, k)) + 1)
+                    ids = np.sort(np.concatenate([self._list(p) for p in order[:num_probes]]))
+                    scores = np.asarray(vectors[ids], dtype=np.float32) @ query
+                    q_scores, q_ids = _merge_top_k(best_scores[:1], best_ids[:1], scores[np.newaxis, :],
+                                                   ids[np.newaxis, :], k)
+                    scores_per_query.append(q_scores[0])
+                    ids_per_query.append(q_ids[0])
+                results = zip(scores_per_query, ids_per_query)
+            else:
+                for start in range(0, count, self.SEARCH_CHUNK):
+                    block = np.asarray(vectors[start:start + self.SEARCH_CHUNK], dtype=np.float32)
+                    ids = np.arange(start, start + len(block))[np.newaxis, :]
+                    best_scores, best_ids = _merge_top_k(best_scores, best_ids, queries @ block.T, ids, k)
+                results = zip(best_scores, best_ids)
+
+            matches = []
+            for scores, ids in results:
+                order = np.argsort(-scores)
+                records = self._read_metadata(ids[order])
+                matches.append([dict(record, score=float(scores[i])) for record, i in zip(records, order)])
+            return matches
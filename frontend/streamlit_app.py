@@ -1,3 +1,5 @@
+import base64
+import io
 import os
 import streamlit as st
 import requests
@@ -42,9 +44,14 @@ def signup(username, email, password):
     return None
 
 
-def predict(file, patient_id):
+def predict(file, patient_id, tta=False, index_embedding=True, explain=False):
     files = {"file": file}
-    data = {"patient_id": patient_id}
+    data = {
+        "patient_id": patient_id,
+        "tta": "true" if tta else "false",
+        "index_embedding": "true" if index_embedding else "false",
+        "explain": "png" if explain else "",
+    }
 
     try:
         response = requests.post(f"{API_URL}/predict", files=files, data=data)
@@ -58,6 +65,39 @@ def predict(file, patient_id):
         return None
 
 
+def find_similar(file, k):
+    files = {"file": file}
+    data = {"k": k}
+
+    try:
+        response = requests.post(f"{API_URL}/similar", files=files, data=data)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Error: {response.json().get('error', 'Unknown error')}")
+            return None
+    except requests.RequestException as e:
+        st.error(f"Network error: {str(e)}")
+        return None
+
+
+def get_explanation(explanation_key, model_version):
+    try:
+        response = requests.get(f"{API_URL}/explanation/{explanation_key}", params={"model_version": model_version})
+        if response.status_code == 200:
+            return response.json()
+    except requests.RequestException:
+        pass
+    return None
+
+
+def show_explanation(explanation):
+    if explanation and explanation.get('format') == 'png':
+        overlay = Image.open(io.BytesIO(base64.b64decode(explanation['overlay'])))
+        st.image(overlay, caption=f"Regions driving the {explanation['target_class']} score",
+                 use_column_width=False)
+
+
 def get_patient_history(patient_id):
     response = requests.get(f"{API_URL}/patient_history/{patient_id}")
     if response.status_code == 200:
@@ -123,7 +163,7 @@ def main():
         """)
         st.markdown('</div>', unsafe_allow_html=True)
 
-        menu = ["Upload Scan", "Patient History", "Logout"]
+        menu = ["Upload Scan", "Similar Cases", "Patient History", "Logout"]
         choice = st.sidebar.selectbox("Menu", menu)
 
         if choice == "Upload Scan":
@@ -150,24 +190,30 @@ def main():
                     except Exception as e:
                         st.error(f"Error opening saved image: {str(e)}")  # Show error in the Streamlit app
 
+                tta = st.checkbox("Test-time augmentation (slower, averages several views of each scan)")
+                index_embedding = st.checkbox("Add scans to the similar-case index", value=True)
+                explain = st.checkbox("Show Grad-CAM explanation heatmaps")
+
                 if st.button('Predict'):
                     if patient_id:
                         with st.spinner('Processing...'):
                             for uploaded_file in uploaded_files:
                                 try:
-                                    result = predict(uploaded_file, patient_id)
+                                    result = predict(uploaded_file, patient_id, tta, index_embedding, explain)
                                     if result:
                                         # st.write(f"Raw response: {result}")  # Commented out raw response
                                         for prediction in result:  # Iterate through the list of predictions
-                                            if 'disease' in prediction:  # Commented out the condition checking 'probabilities'
+                                            if 'disease' in prediction:
                                                 st.success(
                                                     f"Predicted disease for {prediction['filename']}: {prediction['disease']}")
 
-                                                # Commented out probabilities display
-                                                # st.write("Probabilities:")
-                                                # for disease, prob in prediction['probabilities'].items():
-                                                #     st.progress(float(prob))  # Convert to float to ensure it's a number
-                                                #     st.write(f"{disease}: {prob:.2%}")
+                                                if 'probabilities' in prediction:
+                                                    st.write("Probabilities:")
+                                                    for disease, prob in prediction['probabilities'].items():
+                                                        st.progress(float(prob))  # Convert to float to ensure it's a number
+                                                        st.write(f"{disease}: {prob:.2%}")
+
+                                                show_explanation(prediction.get('explanation'))
 
                                             else:
                                                 st.error(
@@ -178,6 +224,30 @@ def main():
                                     st.error(f"An error occurred during prediction for {uploaded_file.name}: {str(e)}")
                     else:
                         st.warning("Please enter a Patient ID before predicting.")
+        elif choice == "Similar Cases":
+            st.subheader("Find Similar Cases")
+            similar_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"], key="similar_upload")
+            top_k = st.number_input("Number of similar cases", min_value=1, max_value=50, value=5)
+            if st.button("Search", key="similar_button"):
+                if similar_file:
+                    with st.spinner('Searching...'):
+                        result = find_similar(similar_file, int(top_k))
+                    if result:
+                        for query in result:
+                            if 'similar' not in query:
+                                st.error(f"Search failed for {query.get('filename', 'unknown file')}")
+                                continue
+                            st.write(f"Predicted disease for {query['filename']}: {query['disease']}")
+                            if not query['similar']:
+                                st.info("No prior scans in the index yet.")
+                            for match in query['similar']:
+                                st.write(f"Patient: {match.get('patient_id')} | File: {match.get('filename')} | "
+                                         f"Prediction: {match.get('disease')} | Similarity: {match['score']:.2f}")
+                                st.caption(f"History record: {match.get('history_id')}")
+                            st.write("---")
+                else:
+                    st.warning("Please choose an image to search with.")
+
         elif choice == "Patient History":
             st.subheader("Patient History")
             history_patient_id = st.text_input("Enter Patient ID to view history")
@@ -189,6 +259,10 @@ def main():
                         for item in history:
                             st.write(f"File: {item['filename']}")
                             st.write(f"Prediction: {item['prediction']['disease']}")
+                            if item['prediction'].get('explanation_key'):
+                                # Only cached explanations are shown; nothing is recomputed here
+                                show_explanation(get_explanation(item['prediction']['explanation_key'],
+                                                                 item['prediction'].get('model_version')))
                             st.write("---")
                     else:
                         st.info("No history found for this patient.")
@@ -0,0 +1,59 @@
+
+import sys
+import time
+from pathlib import Path
+import logging
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from backend.config import Config
+from backend.utils import load_model
+from backend.explain import build_explain_model, find_last_conv_layer, predict_with_gradcam
+
+
+def _median_ms(fn, repeats):
+    fn()  # Warm-up, excludes graph tracing from the measurement
+    durations = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return float(np.median(durations))
+
+
+def benchmark_explain(batch_sizes=(1, 4, 16), repeats=5):
+    """Compare plain prediction latency with the batched Grad-CAM pass"""
+    try:
+        Config.init_app()
+        model = load_model()
+        conv_layer = find_last_conv_layer(model)
+        explain_model = build_explain_model(model, conv_layer)
+
+        for batch_size in batch_sizes:
+            batch = np.random.default_rng(0).uniform(
+                0, 255, (batch_size, Config.IMAGE_SIZE, Config.IMAGE_SIZE, 3)).astype(np.float32)
+            predict_ms = _median_ms(lambda: model.predict(batch, verbose=0), repeats)
+            # model.predict adds fixed per-call overhead, so also time the bare forward pass
+            forward_ms = _median_ms(lambda: explain_model(batch, training=False), repeats)
+            explain_ms = _median_ms(lambda: predict_with_gradcam(explain_model, batch), repeats)
+            logger.info(f"batch={batch_size}: predict {predict_ms:.1f}ms, forward {forward_ms:.1f}ms, "
+                        f"forward+Grad-CAM {explain_ms:.1f}ms (overhead vs forward {explain_ms - forward_ms:.1f}ms, "
+                        f"x{explain_ms / forward_ms:.2f})")
+
+        return True
+    except Exception as e:
+        logger.error(f"Error benchmarking explanations: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    success = benchmark_explain()
+    logger.info(f"Explanation benchmark {'successful' if success else 'failed'}")
@@ -0,0 +1,72 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from backend.augment import write_tta_views
+
+
+def _images(n=2, size=6):
+    return np.random.default_rng(0).integers(0, 255, (n, size, size, 3)).astype(np.uint8)
+
+
+def _write(images, views):
+    out = np.empty((len(images) * len(views),) + images.shape[1:], dtype=np.float32)
+    return write_tta_views(images, views, out)
+
+
+def test_identity_is_a_no_op():
+    images = _images()
+    np.testing.assert_array_equal(_write(images, ('identity',)), images)
+
+
+def test_flips_match_np_flip():
+    images = _images()
+    out = _write(images, ('identity', 'hflip', 'vflip'))
+    np.testing.assert_array_equal(out[1], np.flip(images[0], axis=1))
+    np.testing.assert_array_equal(out[2], np.flip(images[0], axis=0))
+
+
+def test_rotations_match_np_rot90_on_odd_sized_images():
+    images = _images(size=5)
+    out = _write(images, ('identity', 'rot:90', 'rot:-90', 'rot:180'))
+    np.testing.assert_array_equal(out[1], np.rot90(images[0], k=-1))
+    np.testing.assert_array_equal(out[2], np.rot90(images[0], k=1))
+    np.testing.assert_array_equal(out[3], np.rot90(images[0], k=2))
+
+
+def test_crop_keeps_centre_and_maps_corners_inward():
+    images = _images(size=5)
+    crop = _write(images, ('identity', 'crop:0.5'))[1]
+    # Half-size centre crop of a 5x5 image samples rows/cols 1..3, stretched back to 5x5
+    np.testing.assert_array_equal(crop[2, 2], images[0, 2, 2])
+    np.testing.assert_array_equal(crop[0, 0], images[0, 1, 1])
+    np.testing.assert_array_equal(crop[0, 4], images[0, 1, 3])
+    np.testing.assert_array_equal(crop[4, 0], images[0, 3, 1])
+    np.testing.assert_array_equal(crop[4, 4], images[0, 3, 3])
+
+
+def test_views_of_each_image_are_contiguous():
+    images = _images(n=3, size=5)
+    views = ('identity', 'hflip', 'vflip', 'rot:90', 'crop:0.5')
+    out = _write(images, views).reshape((3, len(views)) + images.shape[1:])
+    for i, image in enumerate(images):
+        expected = [
+            image,
+            np.flip(image, axis=1),
+            np.flip(image, axis=0),
+            np.rot90(image, k=-1),
+            # Source coords -1, -0.5, 0, 0.5, 1 around the centre round half-to-even to rows/cols 1, 2, 2, 2, 3
+            image[np.ix_([1, 2, 2, 2, 3], [1, 2, 2, 2, 3])],
+        ]
+        for k, view in enumerate(expected):
+            np.testing.assert_array_equal(out[i, k], view)
+
+
+def test_identity_must_come_first():
+    with pytest.raises(ValueError):
+        _write(_images(), ('hflip', 'identity'))
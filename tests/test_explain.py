@@ -0,0 +1,120 @@
+import base64
+import sys
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from backend.explain import (ExplanationCache, build_explain_model, explanation_key, find_last_conv_layer,
+                             format_explanation, predict_with_gradcam, render_overlay)
+
+CLASS_NAMES = ['Cataract', 'Diabetic Retinopathy', 'Glaucoma', 'Normal']
+
+
+def _tiny_model():
+    inputs = tf.keras.Input((16, 16, 3))
+    x = tf.keras.layers.Conv2D(4, 3, activation='relu', name='conv')(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(len(CLASS_NAMES), activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def _nested_base_model():
+    # Pretrained-backbone layout: a base Model wrapped in a Sequential with a classifier head
+    base_inputs = tf.keras.Input((16, 16, 3))
+    x = tf.keras.layers.Conv2D(4, 3, activation='relu', name='base_conv1')(base_inputs)
+    x = tf.keras.layers.Conv2D(6, 3, activation='relu', name='base_conv2')(x)
+    base = tf.keras.Model(base_inputs, tf.keras.layers.BatchNormalization()(x), name='base')
+    return tf.keras.Sequential([
+        tf.keras.Input((16, 16, 3)),
+        base,
+        tf.keras.layers.GlobalAveragePooling2D(name='pool'),
+        tf.keras.layers.Dense(len(CLASS_NAMES), activation='softmax'),
+    ])
+
+
+def test_cache_round_trip_and_miss(tmp_path):
+    cache = ExplanationCache(tmp_path)
+    key = explanation_key('a' * 64, 'conv', ('identity',))
+    heatmap = np.linspace(0, 1, 49, dtype=np.float32).reshape(7, 7)
+
+    assert cache.get('v1', key) is None
+    cache.put('v1', key, heatmap, b'png-bytes', 2)
+
+    cached_heatmap, overlay_png, target_class = cache.get('v1', key)
+    np.testing.assert_allclose(cached_heatmap, heatmap, atol=1e-3)
+    assert overlay_png == b'png-bytes'
+    assert target_class == 2
+    assert cache.get('v2', key) is None
+
+
+def test_explanation_key_depends_on_views_and_layer():
+    keys = {
+        explanation_key('a' * 64, 'conv', ('identity',)),
+        explanation_key('a' * 64, 'conv', ('identity', 'hflip')),
+        explanation_key('a' * 64, 'other_conv', ('identity',)),
+    }
+    assert len(keys) == 3
+
+
+def test_format_explanation_png_and_array():
+    heatmap = np.array([[0.12345, 1.0], [0.0, 0.5]], dtype=np.float32)
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    overlay_png = render_overlay(heatmap, image, 8)
+
+    png = format_explanation(heatmap, overlay_png, 1, 'png', CLASS_NAMES)
+    assert png['format'] == 'png'
+    assert png['target_class'] == 'Diabetic Retinopathy'
+    assert base64.b64decode(png['overlay']) == overlay_png
+
+    array = format_explanation(heatmap, overlay_png, 1, 'array', CLASS_NAMES)
+    assert array['format'] == 'array'
+    assert array['heatmap'] == [[0.123, 1.0], [0.0, 0.5]]
+
+
+def test_predict_with_gradcam_batches_views():
+    model = _tiny_model()
+    explain_model = build_explain_model(model, find_last_conv_layer(model))
+    num_images, num_views = 2, 3
+    batch = np.random.default_rng(0).uniform(0, 1, (num_images * num_views, 16, 16, 3)).astype(np.float32)
+
+    outputs, heatmaps, targets = predict_with_gradcam(explain_model, batch, num_views)
+
+    assert heatmaps.shape == (num_images, 14, 14)
+    assert heatmaps.min() >= 0 and heatmaps.max() <= 1
+    assert targets.shape == (num_images,)
+    # The logits output reproduces the served probabilities
+    np.testing.assert_allclose(tf.nn.softmax(outputs[-2]).numpy(), outputs[-1], atol=1e-6)
+    np.testing.assert_allclose(outputs[-1], model.predict(batch, verbose=0), atol=1e-6)
+
+
+def test_cache_put_is_atomic_and_leaves_no_temp_files(tmp_path):
+    cache = ExplanationCache(tmp_path)
+    key = explanation_key('b' * 64, 'conv', ('identity',))
+    heatmap = np.zeros((7, 7), dtype=np.float32)
+
+    cache.put('v1', key, heatmap, b'first', 0)
+    cache.put('v1', key, heatmap, b'second', 1)
+
+    assert cache.get('v1', key)[1:] == (b'second', 1)
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.npz', '.png']
+
+
+def test_gradcam_looks_inside_nested_base_model():
+    model = _nested_base_model()
+    conv_layer = find_last_conv_layer(model)
+    assert conv_layer is model.get_layer('base').layers[-1]
+
+    explain_model = build_explain_model(model, conv_layer, [model.get_layer('pool')])
+    batch = np.random.default_rng(1).uniform(0, 1, (4, 16, 16, 3)).astype(np.float32)
+    outputs, heatmaps, targets = predict_with_gradcam(explain_model, batch, num_views=2)
+
+    assert heatmaps.shape == (2, 12, 12)
+    assert heatmaps.min() >= 0 and heatmaps.max() <= 1
+    assert targets.shape == (2,)
+    assert outputs[1].shape == (4, 6)
+    np.testing.assert_allclose(tf.nn.softmax(outputs[-2]).numpy(), outputs[-1], atol=1e-6)
+    np.testing.assert_allclose(outputs[-1], model.predict(batch, verbose=0), atol=1e-6)
@@ -0,0 +1,127 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from backend.vector_index import EmbeddingIndex
+
+
+def _records(start, count):
+    return [{'history_id': f'h{i}', 'patient_id': 'p1'} for i in range(start, start + count)]
+
+
+def test_brute_force_search_finds_exact_match(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 32)).astype(np.float32)
+
+    index = EmbeddingIndex(tmp_path, dim=32)
+    index.add(vectors, _records(0, 500))
+
+    matches = index.search(vectors[[7, 123]], k=3)
+    assert [m[0]['history_id'] for m in matches] == ['h7', 'h123']
+    assert matches[0][0]['score'] > 0.99
+    assert matches[0][0]['score'] >= matches[0][1]['score'] >= matches[0][2]['score']
+
+
+def test_index_reopens_and_appends(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(20, 8)).astype(np.float32)
+
+    EmbeddingIndex(tmp_path, dim=8).add(vectors[:10], _records(0, 10))
+    index = EmbeddingIndex(tmp_path, dim=8)
+    assert len(index) == 10
+
+    index.add(vectors[10:], _records(10, 10))
+    assert len(index) == 20
+    assert index.search(vectors[15], k=1)[0][0]['history_id'] == 'h15'
+
+
+def test_ivf_search_matches_brute_force_for_stored_vectors(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+
+    index = EmbeddingIndex(tmp_path, dim=16)
+    index.add(vectors[:1500], _records(0, 1500))
+    index.build_ivf(nlist=16)
+    # Vectors added after training are assigned to their nearest list
+    index.add(vectors[1500:], _records(1500, 500))
+
+    reopened = EmbeddingIndex(tmp_path, dim=16)
+    assert reopened.has_ivf
+    matches = reopened.search(vectors[[3, 1800]], k=1, nprobe=2)
+    assert [m[0]['history_id'] for m in matches] == ['h3', 'h1800']
+
+
+def test_reopening_with_different_dim_or_model_keeps_data(tmp_path):
+    vectors = np.random.default_rng(3).normal(size=(10, 8)).astype(np.float32)
+    EmbeddingIndex(tmp_path, dim=8, model_version='v1').add(vectors, _records(0, 10))
+
+    with pytest.raises(ValueError):
+        EmbeddingIndex(tmp_path, dim=16, model_version='v1')
+    with pytest.raises(ValueError):
+        EmbeddingIndex(tmp_path, dim=8, model_version='v2')
+
+    index = EmbeddingIndex(tmp_path, dim=8, model_version='v1')
+    assert len(index) == 10
+    assert index.search(vectors[9], k=1)[0][0]['history_id'] == 'h9'
+
+
+def test_uncommitted_tail_is_ignored_and_overwritten(tmp_path):
+    vectors = np.random.default_rng(4).normal(size=(6, 8)).astype(np.float32)
+    EmbeddingIndex(tmp_path, dim=8).add(vectors[:4], _records(0, 4))
+    # Simulate a crash after the vector write but before the commit
+    with open(tmp_path / EmbeddingIndex.VECTORS_FILE, 'ab') as f:
+        f.write(np.ones(8, dtype=np.float16).tobytes())
+
+    index = EmbeddingIndex(tmp_path, dim=8)
+    assert len(index) == 4
+    index.add(vectors[4:], _records(4, 2))
+
+    reopened = EmbeddingIndex(tmp_path, dim=8)
+    assert len(reopened) == 6
+    assert reopened.search(vectors[4], k=1)[0][0]['history_id'] == 'h4'
+
+
+def test_ivf_widens_probes_until_k_candidates(tmp_path):
+    vectors = np.random.default_rng(5).normal(size=(200, 8)).astype(np.float32)
+
+    index = EmbeddingIndex(tmp_path, dim=8)
+    index.add(vectors, _records(0, 200))
+    index.build_ivf(nlist=20)
+
+    matches = index.search(vectors[:3], k=10, nprobe=1)
+    assert [len(m) for m in matches] == [10, 10, 10]
+
+
+def test_ivf_is_built_when_threshold_is_crossed(tmp_path):
+    vectors = np.random.default_rng(6).normal(size=(300, 8)).astype(np.float32)
+
+    index = EmbeddingIndex(tmp_path, dim=8, ivf_nlist=8, ivf_min_vectors=250)
+    index.add(vectors[:200], _records(0, 200))
+    assert not index.has_ivf
+
+    index.add(vectors[200:], _records(200, 100))
+    index.wait_for_ivf()
+    assert index.has_ivf
+    assert index.search(vectors[250], k=1)[0][0]['history_id'] == 'h250'
+
+
+def test_ivf_lists_are_extended_in_place_on_append(tmp_path):
+    vectors = np.random.default_rng(7).normal(size=(400, 8)).astype(np.float32)
+
+    index = EmbeddingIndex(tmp_path, dim=8)
+    index.add(vectors[:300], _records(0, 300))
+    index.build_ivf(nlist=8)
+
+    for start in range(300, 400, 10):
+        index.add(vectors[start:start + 10], _records(start, 10))
+        # Each new vector is searchable straight away through its own list
+        assert index.search(vectors[start + 5], k=1, nprobe=1)[0][0]['history_id'] == f'h{start + 5}'
+
+    reopened = EmbeddingIndex(tmp_path, dim=8)
+    for p in range(8):
+        np.testing.assert_array_equal(reopened._list(p), index._list(p))